@@ -0,0 +1,83 @@
+"""
+Splitting of fused '--summarize' responses into a summary and an answer.
+"""
+
+import re
+
+# Marker the model is asked to put before its answer
+ANSWER_MARKER = "ANSWER:"
+
+# What llama3 actually writes varies ("ANSWER:", "Answer:", "**Answer:**"), so the
+# marker is matched case-insensitively at the start of a line, ignoring markdown
+ANSWER_PATTERN = re.compile(r"^[ \t#*_>]*answer[ \t*_]*:[ \t*_]*", re.IGNORECASE | re.MULTILINE)
+
+# Decoration left over after the marker (e.g. a closing '**' arriving in a later
+# chunk), followed by the blank space before the answer text itself
+LEADING_DECORATION = re.compile(r"[ \t*_]*\s*")
+
+class AnswerSplitter:
+    """
+    Incrementally splits a streamed fused response into summary and answer text.
+
+    Summary text is released a line at a time, holding back the unfinished last
+    line (and its preceding newline) since it may still turn into the marker.
+    Answer text is held until the first character past any marker decoration.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.emitted = 0 # Characters of text already released
+        self.in_answer = False # Marker seen
+        self.answer_started = False # First real answer character released
+
+    def feed(self, chunk: str) -> tuple:
+        """Adds a streamed chunk and returns the (summary, answer) text now safe to print."""
+        self.text += chunk
+        summary = ""
+        if not self.in_answer:
+            match = ANSWER_PATTERN.search(self.text, self.emitted)
+            if not match:
+                safe_end = max(self.emitted, self.text.rfind("\n"))
+                summary = self.text[self.emitted:safe_end]
+                self.emitted = safe_end
+                return summary, ""
+            summary = self.text[self.emitted:match.start()].rstrip()
+            self.in_answer = True
+            self.emitted = match.end()
+        return summary, self._release_answer(final=False)
+
+    def finish(self) -> tuple:
+        """Returns the (summary, answer) text still held back once the stream ends."""
+        if not self.in_answer:
+            summary = self.text[self.emitted:].rstrip()
+            self.emitted = len(self.text)
+            return summary, ""
+        return "", self._release_answer(final=True)
+
+    def _release_answer(self, final: bool) -> str:
+        """Returns unreleased answer text, skipping decoration left after the marker."""
+        if not self.answer_started:
+            lead_end = LEADING_DECORATION.match(self.text, self.emitted).end()
+            if lead_end == len(self.text):
+                # Only decoration so far; more may follow before the answer begins
+                if final:
+                    self.emitted = lead_end
+                return ""
+            self.answer_started = True
+            self.emitted = lead_end
+        answer = self.text[self.emitted:]
+        self.emitted = len(self.text)
+        return answer
+
+def split_summary(text: str) -> tuple:
+    """
+    Splits a complete fused response into (summary, answer). Without a marker
+    the whole response is the answer. Uses AnswerSplitter so the saved answer
+    matches what was streamed to the console.
+    """
+    splitter = AnswerSplitter()
+    summary, answer = splitter.feed(text)
+    rest_summary, rest_answer = splitter.finish()
+    if not splitter.in_answer:
+        return "", text.strip()
+    return (summary + rest_summary).strip(), (answer + rest_answer).strip()
@@ -12,18 +12,58 @@ load_dotenv()
 PDF_PATH = "data/jemh109.pdf"
 #QDRANT_PATH = "./qdrant_db" # Directory to store local Qdrant database
 QDRANT_URL = "http://localhost:6333"
+QDRANT_GRPC_PORT = 6334 # Used for bulk uploads during indexing
 # --- Qdrant Settings ---
 COLLECTION_NAME = "jmeh_multimodal"
+RETRIEVAL_CACHE_DIR = "./.rag_cache" # Cached retrieval results, cleared on re-index
+
+# --- Retrieval Settings ---
+RETRIEVAL_K = 5 # Chunks passed to the LLM
+RETRIEVAL_PREFETCH_LIMIT = 50 # ANN candidates re-ranked with the score formula
+# Added to the similarity score by chunk type; image summaries are derivative content
+TYPE_SCORE_BOOSTS = {
+    "table": 0.1,
+    "image_summary": -0.05,
+}
 
 # --- Model Settings (Ollama) ---
 # Make sure you have pulled these models:
-# $ ollama pull nomic-embed-text
-# $ ollama pull llava
-# $ ollama pull llama3
-TEXT_EMBEDDING_MODEL = "nomic-embed-text"
-IMAGE_SUMMARY_MODEL = "llava-cpu" # Local VLM for summarizing images
-LLM_MODEL = "llama3" # For RAG answers
+# $ ollama pull nomic-embed-text:latest
+# $ ollama pull llava:7b-v1.6-mistral-q4_K_M
+# $ ollama pull llama3:8b-instruct-q4_K_M
+# Quantized tags roughly halve RAM and double throughput on CPU.
+TEXT_EMBEDDING_MODEL = "nomic-embed-text:latest"
+IMAGE_SUMMARY_MODEL = "llava-cpu" # Local VLM for summarizing images (see llava-cpu.Modelfile)
+LLM_MODEL = "llama3:8b-instruct-q4_K_M" # For RAG answers
 OLLAMA_BASE_URL = "http://localhost:11434"
+OLLAMA_KEEP_ALIVE = "1h" # How long Ollama keeps models loaded after a request
+OLLAMA_KEEP_ALIVE_SECONDS = 3600 # Same duration, for clients that only accept seconds
+
+# --- Embedding Backend ---
+# "ollama" uses TEXT_EMBEDDING_MODEL; "onnx" runs the exported model below on CPU.
+# Re-run setup_pipeline.py after switching, the two backends aren't mixed in one index.
+EMBEDDING_BACKEND = "ollama"
+ONNX_MODEL_DIR = "./onnx-int8"
+ONNX_MODEL_FILE = "model_quantized.onnx"
+ONNX_TOKENIZER = "nomic-ai/nomic-embed-text-v1.5"
+ONNX_BATCH_SIZE = 32 # Texts per ONNX Runtime call
+ONNX_MAX_LENGTH = 512 # Tokens per text
+
+# --- Ingestion Settings ---
+PARTITION_WORKERS = max(1, (os.cpu_count() or 2) // 2) # Pages partitioned in parallel
+PARTITION_THREADS_PER_WORKER = 2 # OpenMP/BLAS threads per partitioning worker
+FIGURES_DIR = "./figures" # Extracted image and table crops, one subdirectory per page
+# Concurrent LlaVA requests; keep in line with the server's OLLAMA_NUM_PARALLEL
+OLLAMA_NUM_PARALLEL = int(os.getenv("OLLAMA_NUM_PARALLEL", "4"))
+IMAGE_BATCH_SIZE = 4 # Images described per LlaVA request
+IMAGE_MAX_SIZE = 672 # Images are downscaled to LlaVA's native input resolution
+IMAGE_MIN_SIZE = 64 # Images smaller than this on both sides (bullets, noise) are skipped
+IMAGE_SUMMARY_CACHE_PATH = "./.image_summary_cache.json" # Summaries reused across runs
+EMBED_BATCH_SIZE = 32 # Texts per /api/embed request (128 works well on a CUDA host)
+TEXT_CHUNK_SIZE = 1800 # Max characters per text chunk (~512 tokens)
+TEXT_CHUNK_OVERLAP = 150 # Characters shared between adjacent text chunks
+UPLOAD_BATCH_SIZE = 256 # Points per Qdrant upload request
+UPLOAD_PARALLEL = 4 # Parallel Qdrant upload workers
 
 # --- HuggingFace (for unstructured) ---
 # Used by unstructured to download helper models for layout detection
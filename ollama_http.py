@@ -0,0 +1,36 @@
+"""
+Shared HTTP connection settings for talking to the Ollama server.
+"""
+
+import httpx
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# --- Direct API calls (/api/embed, /api/generate) ---
+# One keep-alive session so repeated requests reuse pooled connections
+session = requests.Session()
+_adapter = HTTPAdapter(
+    pool_connections=16,
+    pool_maxsize=32,
+    max_retries=Retry(total=3, backoff_factor=0.2),
+)
+session.mount("http://", _adapter)
+session.mount("https://", _adapter)
+
+# (connect, read) seconds; a cold model load or a large embed batch fits well within this
+REQUEST_TIMEOUT = (10, 300)
+
+# --- langchain-ollama clients (ChatOllama, OllamaEmbeddings) ---
+# Passed through to the underlying httpx clients for query-time calls
+CLIENT_KWARGS = {
+    "timeout": httpx.Timeout(300.0, connect=10.0),
+    "limits": httpx.Limits(max_keepalive_connections=32),
+}
+
+# Image summarization during ingest: batches queued behind a busy CPU-only LlaVA
+# can wait indefinitely for their first byte, so only connecting is time-limited
+VISION_CLIENT_KWARGS = {
+    "timeout": httpx.Timeout(None, connect=10.0),
+    "limits": httpx.Limits(max_keepalive_connections=32),
+}
@@ -0,0 +1,64 @@
+"""
+ONNX Runtime embedding backend for nomic-embed-text.
+
+Used instead of Ollama when config.EMBEDDING_BACKEND is "onnx". The model
+must be exported and quantized once beforehand (see README).
+"""
+
+from pathlib import Path
+
+import numpy as np
+import onnxruntime as ort
+from langchain_core.embeddings import Embeddings
+from transformers import AutoTokenizer
+
+import config
+
+class OnnxEmbeddings(Embeddings):
+    """Embeds texts on CPU with an int8 ONNX export of nomic-embed-text."""
+
+    def __init__(self):
+        self.tokenizer = AutoTokenizer.from_pretrained(config.ONNX_TOKENIZER)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(
+            str(Path(config.ONNX_MODEL_DIR) / config.ONNX_MODEL_FILE),
+            sess_options=options,
+            providers=["CPUExecutionProvider"],
+        )
+        self.input_names = [i.name for i in self.session.get_inputs()]
+
+    def embed_documents(self, texts: list) -> list:
+        """
+        Tokenizes all texts once, then runs them in length-sorted batches so
+        each batch is padded only to its own longest text.
+        """
+        encoded = self.tokenizer(texts, truncation=True, max_length=config.ONNX_MAX_LENGTH)
+        order = sorted(range(len(texts)), key=lambda i: len(encoded["input_ids"][i]))
+
+        vectors = [None] * len(texts)
+        for start in range(0, len(order), config.ONNX_BATCH_SIZE):
+            batch_ids = order[start:start + config.ONNX_BATCH_SIZE]
+            padded = self.tokenizer.pad(
+                {key: [values[i] for i in batch_ids] for key, values in encoded.items()},
+                return_tensors="np",
+            )
+            inputs = {
+                name: padded[name].astype(np.int64)
+                for name in self.input_names
+                if name in padded
+            }
+            last_hidden_state = self.session.run(None, inputs)[0]
+            for i, vector in zip(batch_ids, mean_pool(last_hidden_state, padded["attention_mask"])):
+                vectors[i] = vector.tolist()
+        return vectors
+
+    def embed_query(self, text: str) -> list:
+        """Embeds a single query."""
+        return self.embed_documents([text])[0]
+
+def mean_pool(last_hidden_state: np.ndarray, attention_mask: np.ndarray) -> np.ndarray:
+    """Averages token embeddings over the attention mask and L2-normalizes them."""
+    mask = attention_mask[..., None].astype(np.float32)
+    pooled = (last_hidden_state * mask).sum(axis=1) / np.maximum(mask.sum(axis=1), 1e-9)
+    return pooled / np.maximum(np.linalg.norm(pooled, axis=1, keepdims=True), 1e-12)
@@ -1,62 +1,242 @@
 
 import argparse
+import asyncio
+import hashlib
 import json
+from functools import lru_cache
 from pathlib import Path
 
+import numpy as np
+from langchain_core.documents import Document
 from langchain_core.messages import HumanMessage, AIMessage
 from langchain_core.prompts import ChatPromptTemplate, MessagesPlaceholder
 from langchain_core.runnables import RunnablePassthrough, RunnableLambda
 from langchain_core.output_parsers import StrOutputParser
-from langchain_qdrant import Qdrant
 from langchain_ollama import ChatOllama, OllamaEmbeddings
 from qdrant_client import QdrantClient
+from qdrant_client.models import (
+    FieldCondition,
+    FormulaQuery,
+    MatchValue,
+    MultExpression,
+    Prefetch,
+    QuantizationSearchParams,
+    SearchParams,
+    SumExpression,
+)
 
 import config
+import ollama_http
+from answer_splitter import ANSWER_MARKER, AnswerSplitter, split_summary
 
 # ---  Conversational Memory ---
 # Creating a directory to store session histories
 SESSION_DIR = Path("./chat_sessions")
 SESSION_DIR.mkdir(exist_ok=True)
 
+def convert_legacy_session(session_id: str):
+    """Converts a pre-JSONL session file (one JSON list) to the append-only format."""
+    legacy_file = SESSION_DIR / f"{session_id}.json"
+    if not legacy_file.exists():
+        return
+
+    with open(legacy_file, 'r') as f:
+        history_dicts = json.load(f)
+    # The old file is left in place; the .jsonl copy takes precedence from now on
+    with open(SESSION_DIR / f"{session_id}.jsonl", 'w') as f:
+        for msg in history_dicts:
+            f.write(json.dumps(msg, separators=(',', ':')) + "\n")
+    print(f"(Converted legacy session file {legacy_file.name} to JSONL)")
+
 def load_memory(session_id: str) -> list:
-    """Loads chat history from a session file."""
-    session_file = SESSION_DIR / f"{session_id}.json"
+    """Loads chat history from an append-only session file."""
+    session_file = SESSION_DIR / f"{session_id}.jsonl"
+    if not session_file.exists():
+        convert_legacy_session(session_id)
     if not session_file.exists():
         return []
     
-    with open(session_file, 'r') as f:
-        history_dicts = json.load(f)
-        
     messages = []
-    for msg in history_dicts:
-        if msg['type'] == 'human':
-            messages.append(HumanMessage(content=msg['content']))
-        elif msg['type'] == 'ai':
-            messages.append(AIMessage(content=msg['content']))
+    with open(session_file, 'r') as f:
+        for line in f:
+            msg = json.loads(line)
+            if msg['type'] == 'human':
+                messages.append(HumanMessage(content=msg['content']))
+            elif msg['type'] == 'ai':
+                messages.append(AIMessage(content=msg['content']))
     return messages
 
-def save_memory(session_id: str, history_messages: list):
-    """Saves chat history to a session file."""
-    session_file = SESSION_DIR / f"{session_id}.json"
-    history_dicts = []
-    for msg in history_messages:
-        history_dicts.append({
-            "type": "human" if isinstance(msg, HumanMessage) else "ai",
-            "content": msg.content
-        })
-    with open(session_file, 'w') as f:
-        json.dump(history_dicts, f, indent=2)
+def save_memory(session_id: str, new_messages: list):
+    """Appends the new turn's messages to a session file."""
+    session_file = SESSION_DIR / f"{session_id}.jsonl"
+    with open(session_file, 'a') as f:
+        for msg in new_messages:
+            f.write(json.dumps({
+                "type": "human" if isinstance(msg, HumanMessage) else "ai",
+                "content": msg.content
+            }, separators=(',', ':')) + "\n")
+
+# --- Retrieval Cache ---
+# Caching retrieved chunks per question so repeats skip the embed call and Qdrant search
+CACHE_DIR = Path(config.RETRIEVAL_CACHE_DIR)
+CACHE_DIR.mkdir(exist_ok=True)
+
+def normalize_question(question: str) -> str:
+    """Normalizes a question so trivially different phrasings share a cache entry."""
+    return " ".join(question.lower().split())
+
+def cache_file_for(question: str) -> Path:
+    """
+    Returns the cache file for a normalized question. Retrieval settings are
+    part of the key so changing them never serves rankings from the old ones.
+    """
+    settings = json.dumps({
+        "collection": config.COLLECTION_NAME,
+        "backend": config.EMBEDDING_BACKEND,
+        "embedding_model": config.TEXT_EMBEDDING_MODEL,
+        "k": config.RETRIEVAL_K,
+        "prefetch_limit": config.RETRIEVAL_PREFETCH_LIMIT,
+        "type_boosts": config.TYPE_SCORE_BOOSTS,
+    }, sort_keys=True)
+    key = hashlib.sha256((question + settings).encode("utf-8")).hexdigest()
+    return CACHE_DIR / f"{key}.json"
+
+def load_cached_docs(question: str):
+    """Loads cached retrieval results, or None on a cache miss."""
+    cache_file = cache_file_for(question)
+    if not cache_file.exists():
+        return None
+
+    with open(cache_file, 'r') as f:
+        doc_dicts = json.load(f)
+    return [
+        Document(page_content=d['page_content'], metadata=d['metadata'])
+        for d in doc_dicts
+    ]
+
+def save_cached_docs(question: str, docs: list):
+    """Saves retrieval results for a normalized question."""
+    doc_dicts = [
+        {"page_content": d.page_content, "metadata": d.metadata}
+        for d in docs
+    ]
+    with open(cache_file_for(question), 'w') as f:
+        json.dump(doc_dicts, f)
+
+def normalize_vector(vector: list) -> list:
+    """L2-normalizes a query vector to match the unit-length vectors in the collection."""
+    arr = np.asarray(vector, dtype=np.float32)
+    norm = np.linalg.norm(arr)
+    if norm == 0:
+        return arr.tolist()
+    return (arr / norm).tolist()
+
+def build_score_formula() -> FormulaQuery:
+    """Adds per-type boosts from config.TYPE_SCORE_BOOSTS to the similarity score."""
+    return FormulaQuery(formula=SumExpression(sum=[
+        "$score",
+        *(
+            MultExpression(mult=[
+                boost,
+                FieldCondition(key="metadata.type", match=MatchValue(value=doc_type)),
+            ])
+            for doc_type, boost in config.TYPE_SCORE_BOOSTS.items()
+        ),
+    ]))
+
+# --- Prompts ---
+# Built once at import so repeated queries in a long-running process reuse them
+
+# --- RAG Chain (Requirement 2.2) ---
+SYSTEM_PROMPT = (
+    "You are an expert assistant for a 10th-grade mathematics textbook. "
+    "Answer the user's question based *only* on the following context. "
+    "If the context does not contain the answer, state that. "
+    "When possible, cite the page number from the source metadata."
+)
+
+# --- Summarization (Requirement ) ---
+# Folded into the RAG prompt so a single LLM pass produces both summary and answer
+SUMMARIZE_INSTRUCTION = (
+    " Before answering, concisely summarize the context in at most 3 sentences, "
+    "focusing on the key facts, formulas, and definitions. "
+    f"Then write '{ANSWER_MARKER}' on its own line, followed by your answer."
+)
+
+def build_rag_prompt(system_prompt: str) -> ChatPromptTemplate:
+    """Builds the RAG prompt around the given system instructions."""
+    return ChatPromptTemplate.from_messages([
+        ("system", system_prompt),
+        MessagesPlaceholder(variable_name="chat_history"),
+        ("human", "CONTEXT:\n{context}\n\nQUESTION:\n{question}")
+    ])
+
+RAG_PROMPT = build_rag_prompt(SYSTEM_PROMPT)
+RAG_SUMMARIZE_PROMPT = build_rag_prompt(SYSTEM_PROMPT + SUMMARIZE_INSTRUCTION)
 
 def format_docs(docs: list) -> str:
     """Formats retrieved documents into a string."""
-    return "\n\n".join(
-        f"--- Source (Page {d.metadata.get('page_number', 'N/A')}, "
-        f"Type: {d.metadata.get('type', 'text')}) ---\n"
-        f"{d.page_content}"
-        for d in docs
+    parts = []
+    append = parts.append
+    for d in docs:
+        m = d.metadata
+        append(
+            f"--- Source (Page {m.get('page_number', 'N/A')}, "
+            f"Type: {m.get('type', 'text')}) ---\n"
+            f"{d.page_content}"
+        )
+    return "\n\n".join(parts)
+
+def warm_up_models():
+    """
+    Preloads the LLM and embedding model with a zero-token request so the
+    first real query doesn't pay Ollama's cold-start cost.
+    """
+    ollama_http.session.post(
+        f"{config.OLLAMA_BASE_URL}/api/generate",
+        json={"model": config.LLM_MODEL, "prompt": "", "keep_alive": config.OLLAMA_KEEP_ALIVE},
+        timeout=ollama_http.REQUEST_TIMEOUT,
+    ).raise_for_status()
+    if config.EMBEDDING_BACKEND == "onnx":
+        return
+    ollama_http.session.post(
+        f"{config.OLLAMA_BASE_URL}/api/embed",
+        json={"model": config.TEXT_EMBEDDING_MODEL, "input": "", "keep_alive": config.OLLAMA_KEEP_ALIVE},
+        timeout=ollama_http.REQUEST_TIMEOUT,
+    ).raise_for_status()
+
+# --- Models ---
+# Created once per process so a server built around main() reuses the clients
+
+@lru_cache(maxsize=1)
+def get_llm() -> ChatOllama:
+    """Returns the shared chat model used for RAG answers."""
+    return ChatOllama(
+        model=config.LLM_MODEL, 
+        base_url=config.OLLAMA_BASE_URL,
+        keep_alive=config.OLLAMA_KEEP_ALIVE,
+        client_kwargs=ollama_http.CLIENT_KWARGS
+    )
+
+@lru_cache(maxsize=1)
+def get_embeddings():
+    """Returns the shared embedding model for the configured backend."""
+    if config.EMBEDDING_BACKEND == "onnx":
+        from onnx_embeddings import OnnxEmbeddings
+        return OnnxEmbeddings()
+    return OllamaEmbeddings(
+        model=config.TEXT_EMBEDDING_MODEL, 
+        base_url=config.OLLAMA_BASE_URL,
+        keep_alive=config.OLLAMA_KEEP_ALIVE_SECONDS, # Keeps the warm-up's keep-alive in force
+        client_kwargs=ollama_http.CLIENT_KWARGS
     )
 
-def main():
+@lru_cache(maxsize=1024)
+def embed_query(question: str) -> list:
+    """Embeds a question, reusing the vector for repeated questions."""
+    return get_embeddings().embed_query(question)
+
+async def main():
     parser = argparse.ArgumentParser(description="Query the RAG pipeline.")
     parser.add_argument("--question", type=str, required=True, help="The question to ask.")
     parser.add_argument("--summarize", action="store_true", help="Enable summarization of retrieved context.")
@@ -66,24 +246,17 @@ def main():
 
     # 1. Initializing models, vector store, and retriever
     try:
-        llm = ChatOllama(
-            model=config.LLM_MODEL, 
-            base_url=config.OLLAMA_BASE_URL
-        )
-        embeddings = OllamaEmbeddings(
-            model=config.TEXT_EMBEDDING_MODEL, 
-            base_url=config.OLLAMA_BASE_URL
-        )
+        warm_up_models()
+        llm = get_llm()
+        get_embeddings() # Loading up front so failures surface here
         
         # Connecting to the existing local Qdrant
         qdrant_client = QdrantClient(url=config.QDRANT_URL)
         
-        vector_store = Qdrant(
-            client=qdrant_client,
-            collection_name=config.COLLECTION_NAME,
-            embeddings=embeddings
+        # Searching the int8 vectors, then rescoring 2x candidates with the originals
+        search_params = SearchParams(
+            quantization=QuantizationSearchParams(rescore=True, oversampling=2.0)
         )
-        retriever = vector_store.as_retriever(search_kwargs={"k": 5}) # Retrieve top 5 chunks
         
         print("Ollama and Qdrant connections established.")
     except Exception as e:
@@ -98,33 +271,39 @@ def main():
         print(f"--- Loading chat history for session: {args.session_id} ---")
         chat_history = load_memory(args.session_id)
 
-    # 3. Define Chains
+    # 3. Defining the Full Chain (with LCEL)
 
-    # --- Summarization Chain (Requirement ) ---
-    summarizer_prompt = ChatPromptTemplate.from_template(
-        "Concisely summarize the following context, which was retrieved to answer a user's question. "
-        "Focus on the key facts, formulas, and definitions.\n\n"
-        "CONTEXT:\n{context}"
-    )
-    summarizer_chain = summarizer_prompt | llm | StrOutputParser()
-
-    # --- RAG Chain (Requirement 2.2) ---
-    rag_prompt = ChatPromptTemplate.from_messages([
-        ("system",
-         "You are an expert assistant for a 10th-grade mathematics textbook. "
-         "Answer the user's question based *only* on the following context. "
-         "If the context does not contain the answer, state that. "
-         "When possible, cite the page number from the source metadata."),
-        MessagesPlaceholder(variable_name="chat_history"),
-        ("human", "CONTEXT:\n{context}\n\nQUESTION:\n{question}")
-    ])
-
-    # 4. Defining the Full Chain (with LCEL)
+    def retrieve(question: str) -> list:
+        """Returns cached chunks for the question, searching Qdrant on a miss."""
+        question = normalize_question(question)
+        docs = load_cached_docs(question)
+        if docs is None:
+            # Wide ANN prefetch on the quantized index, then re-ranking by type-boosted score
+            points = qdrant_client.query_points(
+                collection_name=config.COLLECTION_NAME,
+                prefetch=Prefetch(
+                    query=normalize_vector(embed_query(question)),
+                    limit=config.RETRIEVAL_PREFETCH_LIMIT,
+                    params=search_params,
+                ),
+                query=build_score_formula(),
+                limit=config.RETRIEVAL_K,
+                with_payload=True,
+            ).points
+            docs = [
+                Document(
+                    page_content=p.payload["page_content"],
+                    metadata=p.payload.get("metadata", {}),
+                )
+                for p in points
+            ]
+            save_cached_docs(question, docs)
+        return docs
 
     # Retrieves documents based on the question
     retrieval_chain = (
         RunnableLambda(lambda x: x["question"]) | 
-        retriever | 
+        RunnableLambda(retrieve) | 
         RunnableLambda(format_docs)
     )
 
@@ -136,34 +315,65 @@ def main():
             # Retrieve context
             context=retrieval_chain
         ) |
-        RunnablePassthrough.assign(
-            # Conditionally summarizing the retrieved context
-            summary=RunnableLambda(
-                lambda x: summarizer_chain.invoke({"context": x["context"]})
-                if args.summarize else "N/A"
-            )
-        ) |
         RunnablePassthrough.assign(
             # Passing the full context, history, and question to the final prompt
-            answer=(rag_prompt | llm | StrOutputParser())
+            answer=(
+                (RAG_SUMMARIZE_PROMPT if args.summarize else RAG_PROMPT) | llm | StrOutputParser()
+            )
         )
     )
 
-    # 5. Invoking the chain and print results
+    # 4. Streaming the chain and printing tokens as they arrive
     
     print(f"--- Querying for: '{args.question}' ---")
-    result = full_rag_chain.invoke({"question": args.question})
+    result = {}
+    splitter = AnswerSplitter()
+    header_printed = False
+    answer_header_printed = not args.summarize
 
-    # --- Summarization Demonstration ---
-    if args.summarize:
-        print("\n### 1. Retrieved Context Summary ###")
-        print(result["summary"])
+    def print_answer_header():
+        print()
         print("-" * 30)
         print("\n### 2. Final RAG Answer ###")
-    else:
-        print("\n### Final RAG Answer ###")
 
-    print(result["answer"])
+    async for chunk in full_rag_chain.astream({"question": args.question}):
+        for key, value in chunk.items():
+            result[key] = result[key] + value if key in result else value
+        if "answer" not in chunk:
+            continue
+
+        if not header_printed:
+            # --- Summarization Demonstration ---
+            if args.summarize:
+                print("\n### 1. Retrieved Context Summary ###")
+            else:
+                print("\n### Final RAG Answer ###")
+            header_printed = True
+
+        if not args.summarize:
+            print(chunk["answer"], end="", flush=True)
+            continue
+
+        summary_text, answer_text = splitter.feed(chunk["answer"])
+        print(summary_text, end="", flush=True)
+        if splitter.in_answer and not answer_header_printed:
+            print_answer_header()
+            answer_header_printed = True
+        print(answer_text, end="", flush=True)
+
+    if args.summarize:
+        summary_text, answer_text = splitter.finish()
+        print(summary_text, end="")
+        if not answer_header_printed:
+            # The model never marked its answer
+            print_answer_header()
+            print("(The model did not separate its answer from the summary; "
+                  "the full response above is the answer.)", end="")
+        print(answer_text, end="")
+    print()
+
+    if args.summarize:
+        _, result["answer"] = split_summary(result["answer"])
     
     # --- Sources Demonstration ---
     print("\n" + "-" * 30)
@@ -171,12 +381,13 @@ def main():
     print(result["context"])
     print("-" * 30)
 
-    # 6. Saving memory for next turn (if session_id is provided)
+    # 5. Saving memory for next turn (if session_id is provided)
     if args.session_id:
-        chat_history.append(HumanMessage(content=args.question))
-        chat_history.append(AIMessage(content=result["answer"]))
-        save_memory(args.session_id, chat_history)
+        save_memory(args.session_id, [
+            HumanMessage(content=args.question),
+            AIMessage(content=result["answer"]),
+        ])
         print(f"\n(Context saved to session: {args.session_id})")
 
 if __name__ == "__main__":
-    main()
+    asyncio.run(main())
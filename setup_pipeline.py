@@ -1,66 +1,244 @@
 import os
+import asyncio
 import base64
 import warnings
 from pathlib import Path
 import io
+import hashlib
+import json
+import shutil
+import tempfile
 
+import numpy as np
+from joblib import Parallel, delayed, parallel_backend
 from PIL import Image
-from langchain_community.vectorstores import Qdrant
-from langchain_ollama.embeddings import OllamaEmbeddings
+from pypdf import PdfReader, PdfWriter
 from langchain_ollama import ChatOllama
 from langchain_core.messages import HumanMessage
 from langchain_core.documents import Document
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+from qdrant_client import QdrantClient
+from qdrant_client.models import (
+    Distance,
+    ScalarQuantization,
+    ScalarQuantizationConfig,
+    ScalarType,
+    VectorParams,
+)
 
+from unstructured.documents.elements import Image as UImage, Table as UTable
 from unstructured.partition.pdf import partition_pdf
 
 import config
+import ollama_http
+from summary_parser import parse_numbered_summaries
 
 # Suppressing common warnings from unstructured
 warnings.filterwarnings("ignore", category=UserWarning)
 
+FAILED_SUMMARY = "Failed to summarize image"
+# Bump whenever the image summary prompt changes so cached summaries are regenerated
+IMAGE_SUMMARY_PROMPT_VERSION = "2"
+
+def image_hash(image_bytes: bytes) -> str:
+    """
+    Returns a cache key for an image's summary. The model, prompt version and
+    image size are part of the key, so changing any of them re-summarizes.
+    """
+    digest = hashlib.blake2b(digest_size=16)
+    settings = f"{config.IMAGE_SUMMARY_MODEL}|{IMAGE_SUMMARY_PROMPT_VERSION}|{config.IMAGE_MAX_SIZE}|"
+    digest.update(settings.encode("utf-8"))
+    digest.update(image_bytes)
+    return digest.hexdigest()
+
+def load_summary_cache() -> dict:
+    """Loads image summaries from previous runs, keyed by image hash."""
+    cache_file = Path(config.IMAGE_SUMMARY_CACHE_PATH)
+    if not cache_file.exists():
+        return {}
+    try:
+        with open(cache_file, 'r') as f:
+            return json.load(f)
+    except json.JSONDecodeError:
+        print(f"Summary cache {cache_file} is unreadable, starting with an empty cache.")
+        return {}
+
+def save_summary_cache(cache: dict):
+    """Saves image summaries so unchanged figures are skipped on re-ingest."""
+    # Write to a temp file and swap it in so an interrupted run can't leave a truncated cache
+    tmp_path = f"{config.IMAGE_SUMMARY_CACHE_PATH}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(cache, f)
+    os.replace(tmp_path, config.IMAGE_SUMMARY_CACHE_PATH)
+
 def encode_image_to_base64(image: Image.Image) -> str:
-    """Encodes a PIL Image to a base64 string."""
+    """Encodes a PIL Image to a base64 JPEG string."""
     buffered = io.BytesIO()
-    image.save(buffered, format="PNG")
+    image.convert("RGB").save(buffered, format="JPEG", quality=85, optimize=False)
     img_str = base64.b64encode(buffered.getvalue()).decode("utf-8")
     return img_str
 
-def summarize_image(image_bytes: bytes, llm_vision: ChatOllama) -> str:
+def prepare_image(image_bytes: bytes):
     """
-    Uses a local VLM (LlaVA) to generate a summary of an image.
-    This summary is what gets embedded.
+    Downscales an image and encodes it for LlaVA.
+    Returns None for images too small to be worth summarizing.
     """
+    pil_image = Image.open(io.BytesIO(image_bytes))
+    # Only images small in both dimensions are noise; thin strips (number lines,
+    # one-line formulas) are real content
+    if max(pil_image.size) < config.IMAGE_MIN_SIZE:
+        return None
+    # LLaVA's vision encoder downsamples anyway, so larger images only add payload
+    pil_image.thumbnail((config.IMAGE_MAX_SIZE, config.IMAGE_MAX_SIZE))
+    return encode_image_to_base64(pil_image)
+
+async def summarize_images(image_batch: list, llm_vision: ChatOllama,
+                           semaphore: asyncio.Semaphore) -> list:
+    """
+    Uses a local VLM (LlaVA) to generate summaries for a batch of images
+    in a single request. These summaries are what gets embedded.
+    Returns one summary per image, None for skipped images.
+    """
+    summaries = [None] * len(image_batch)
+    to_send = [] # (position in batch, base64 image)
+    for i, image_bytes in enumerate(image_batch):
+        try:
+            img_b64 = prepare_image(image_bytes)
+        except Exception as e:
+            print(f"Error summarizing image: {e}")
+            summaries[i] = FAILED_SUMMARY
+            continue
+        if img_b64:
+            to_send.append((i, img_b64))
+    if not to_send:
+        return summaries
+
+    # All images followed by one shared instruction, so the prompt is prefilled once.
+    # langchain-ollama sends the images as an ordered list beside the merged text,
+    # so the model is told to number them by position rather than by inline labels.
+    content = [
+        # Raw base64 goes straight into Ollama's `images` field, no data URL to build or strip
+        {"type": "image_url", "image_url": {"url": img_b64}}
+        for _, img_b64 in to_send
+    ]
+    content.append({
+        "type": "text",
+        "text": (
+            f"You are given {len(to_send)} image(s), numbered 1 to {len(to_send)} "
+            "in the order provided. Describe each image in detail. What mathematical "
+            "concepts, diagrams, or formulas are visible? Be descriptive. These "
+            "descriptions will be used for a search index. Start each description "
+            "with a line '### IMAGE N', where N is the image number."
+        ),
+    })
+
     try:
-        pil_image = Image.open(io.BytesIO(image_bytes))
-        # Resizing for faster processing, LLaVA can handle smaller images
-        pil_image.thumbnail((1024, 1024))
-        
-        img_b64 = encode_image_to_base64(pil_image)
-        
-        msg = HumanMessage(
-            content=[
-                {
-                    "type": "text",
-                    "text": (
-                        "Describe this image in detail. What mathematical concepts, "
-                        "diagrams, or formulas are visible? Be descriptive. This "
-                        "description will be used for a search index."
-                    ),
-                },
-                {
-                    "type": "image_url",
-                    "image_url": f"data:image/png;base64,{img_b64}",
-                },
-            ]
-        )
-        
-        print("  > Summarizing image with LlaVA...")
-        response = llm_vision.invoke([msg])
-        print(f"  > Summary: {response.content[:70]}...")
-        return response.content
+        async with semaphore:
+            print(f"  > Summarizing {len(to_send)} image(s) with LlaVA...")
+            response = await llm_vision.ainvoke([HumanMessage(content=content)])
     except Exception as e:
-        print(f"Error summarizing image: {e}")
-        return "Failed to summarize image"
+        print(f"Error summarizing images: {e}")
+        for i, _ in to_send:
+            summaries[i] = FAILED_SUMMARY
+        return summaries
+
+    parsed = parse_numbered_summaries(response.content, len(to_send))
+    if len(to_send) == 1 and not parsed:
+        # A lone image is often described without the header
+        parsed = {1: response.content.strip()}
+    for n, (i, _) in enumerate(to_send, start=1):
+        summaries[i] = parsed.get(n) or FAILED_SUMMARY
+        print(f"  > Summary: {summaries[i][:70]}...")
+    return summaries
+
+async def gather_summaries(image_elements: list, llm_vision: ChatOllama) -> list:
+    """
+    Summarizes images in batches of IMAGE_BATCH_SIZE, running up to
+    OLLAMA_NUM_PARALLEL batches concurrently.
+    """
+    semaphore = asyncio.Semaphore(config.OLLAMA_NUM_PARALLEL)
+    batches = [
+        [el.image_bytes for el in image_elements[start:start + config.IMAGE_BATCH_SIZE]]
+        for start in range(0, len(image_elements), config.IMAGE_BATCH_SIZE)
+    ]
+    results = await asyncio.gather(*(
+        summarize_images(batch, llm_vision, semaphore)
+        for batch in batches
+    ))
+    return [summary for batch_summaries in results for summary in batch_summaries]
+
+def partition_page(page_path: str, page_number: int, pdf_path: str) -> list:
+    """
+    Partitions a single-page PDF and restores its page number and source
+    file in the full document.
+    """
+    # Every single-page PDF is "page 1" to unstructured, so each page gets its own
+    # output directory to keep concurrent workers from overwriting each other's crops
+    elements = partition_pdf(
+        filename=page_path,
+        strategy="hi_res",  # Use hi_res strategy for better extraction
+        infer_table_structure=True,
+        extract_images_in_pdf=True,
+        extract_image_block_output_dir=str(Path(config.FIGURES_DIR) / f"page_{page_number}"),
+    )
+    source = Path(pdf_path)
+    for el in elements:
+        el.metadata.page_number = page_number
+        el.metadata.filename = source.name
+        el.metadata.file_directory = str(source.parent)
+    return elements
+
+def partition_pdf_parallel(pdf_path: str) -> list:
+    """
+    Splits the PDF into single pages and partitions them in parallel worker
+    processes, since hi_res layout detection runs page by page.
+    """
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        page_paths = []
+        for i, page in enumerate(PdfReader(pdf_path).pages, start=1):
+            writer = PdfWriter()
+            writer.add_page(page)
+            page_path = Path(tmp_dir) / f"page_{i}.pdf"
+            writer.write(page_path)
+            page_paths.append(str(page_path))
+
+        # Capping each worker's BLAS/OpenMP threads so workers don't oversubscribe cores
+        with parallel_backend("loky", inner_max_num_threads=config.PARTITION_THREADS_PER_WORKER):
+            page_elements = Parallel(n_jobs=config.PARTITION_WORKERS)(
+                delayed(partition_page)(page_path, page_number, pdf_path)
+                for page_number, page_path in enumerate(page_paths, start=1)
+            )
+    return [el for elements in page_elements for el in elements]
+
+def embed_texts(texts: list) -> list:
+    """
+    Embeds texts in batches through Ollama's /api/embed endpoint.
+    Falls back to one /api/embeddings call per text on older Ollama servers.
+    """
+    vectors = []
+    for start in range(0, len(texts), config.EMBED_BATCH_SIZE):
+        batch = texts[start:start + config.EMBED_BATCH_SIZE]
+        response = ollama_http.session.post(
+            f"{config.OLLAMA_BASE_URL}/api/embed",
+            json={"model": config.TEXT_EMBEDDING_MODEL, "input": batch},
+            timeout=ollama_http.REQUEST_TIMEOUT,
+        )
+        # Servers predating /api/embed answer 404; any other error is a real failure
+        if response.status_code != 404:
+            response.raise_for_status()
+            vectors.extend(response.json()["embeddings"])
+            continue
+
+        # Legacy endpoint only accepts a single prompt per request
+        for text in batch:
+            response = ollama_http.session.post(
+                f"{config.OLLAMA_BASE_URL}/api/embeddings",
+                json={"model": config.TEXT_EMBEDDING_MODEL, "prompt": text},
+                timeout=ollama_http.REQUEST_TIMEOUT,
+            )
+            response.raise_for_status()
+            vectors.append(response.json()["embedding"])
+    return vectors
 
 def main():
     print(f"Starting pipeline setup for {config.PDF_PATH}...")
@@ -71,13 +249,10 @@ def main():
 
     # 1. Initializing models from Ollama
     try:
-        embeddings = OllamaEmbeddings(
-            model=config.TEXT_EMBEDDING_MODEL,
-            base_url=config.OLLAMA_BASE_URL
-        )
         llm_vision = ChatOllama(
             model=config.IMAGE_SUMMARY_MODEL,
-            base_url=config.OLLAMA_BASE_URL
+            base_url=config.OLLAMA_BASE_URL,
+            client_kwargs=ollama_http.VISION_CLIENT_KWARGS
         )
         # Testing connection
         llm_vision.invoke("test")
@@ -86,8 +261,8 @@ def main():
         print(f"Error initializing Ollama models: {e}")
         print("Please ensure Ollama is running and you have pulled "
               f"'{config.TEXT_EMBEDDING_MODEL}' and '{config.IMAGE_SUMMARY_MODEL}'.")
-        print("$ ollama pull nomic-embed-text")
-        print("$ ollama pull llava")
+        print(f"$ ollama pull {config.TEXT_EMBEDDING_MODEL}")
+        print("$ ollama pull llava:7b-v1.6-mistral-q4_K_M")
         return
 
     # 2. Partitioning the PDF using unstructured
@@ -97,12 +272,7 @@ def main():
     # This is the core of the multimodal extraction.
     # 'hi_res' strategy finds text, tables, and images with better accuracy.
     try:
-        elements = partition_pdf(
-            filename=config.PDF_PATH,
-            strategy="hi_res",  # Use hi_res strategy for better extraction
-            infer_table_structure=True,
-            extract_images_in_pdf=True,
-        )
+        elements = partition_pdf_parallel(config.PDF_PATH)
     except Exception as e:
         print(f"Error during PDF partitioning: {e}")
         print("This often happens if system dependencies like 'poppler' or 'tesseract' are missing.")
@@ -111,24 +281,56 @@ def main():
     print("PDF partitioned. Processing elements...")
     
     documents = []
-    
-    # 3. Processing elements and creating Documents
+
+    # 3. Generating text summaries for all images in parallel
+    image_elements = [
+        el for el in elements
+        if isinstance(el, UImage) and getattr(el, 'image_bytes', None)
+    ]
+    image_keys = [image_hash(el.image_bytes) for el in image_elements]
+
+    # Each distinct image is summarized once; repeats and earlier runs hit the cache
+    summary_cache = load_summary_cache()
+    pending = {}
+    for key, el in zip(image_keys, image_elements):
+        if key not in summary_cache:
+            pending.setdefault(key, el)
+    summaries = asyncio.run(gather_summaries(list(pending.values()), llm_vision))
+
+    summaries_by_key = dict(summary_cache)
+    summaries_by_key.update(zip(pending, summaries))
+    # Failures are retried and skipped images re-checked on the next run
+    summary_cache.update(
+        (key, summary) for key, summary in zip(pending, summaries)
+        if summary not in (None, FAILED_SUMMARY)
+    )
+    save_summary_cache(summary_cache)
+
+    summary_by_element = {
+        id(el): summaries_by_key[key]
+        for key, el in zip(image_keys, image_elements)
+        if summaries_by_key[key] is not None
+    }
+
+    # 4. Processing elements and creating Documents
+    # ~1800 characters is roughly nomic-embed-text's 512-token sweet spot
+    text_splitter = RecursiveCharacterTextSplitter(
+        chunk_size=config.TEXT_CHUNK_SIZE,
+        chunk_overlap=config.TEXT_CHUNK_OVERLAP,
+        length_function=len,
+    )
     for el in elements:
-        element_type = str(type(el)).split('.')[-1].replace("'", "").replace(">", "")
-        
-        if element_type == "Image":
-            if hasattr(el, 'image_bytes') and el.image_bytes:
-                # Generating a text summary for the image
-                summary = summarize_image(el.image_bytes, llm_vision)
+        if isinstance(el, UImage):
+            if id(el) in summary_by_element:
                 documents.append(Document(
-                    page_content=summary,
+                    page_content=summary_by_element[id(el)],
                     metadata={
                         "source": config.PDF_PATH,
                         "page_number": el.metadata.page_number,
                         "type": "image_summary"
                     }
                 ))
-        elif "Table" in element_type:
+        elif isinstance(el, UTable): # Also covers TableChunk
             # Tables are often better represented by their HTML or text
             if el.metadata.text_as_html:
                 content = f"Table on page {el.metadata.page_number}:\n{el.metadata.text_as_html}"
@@ -142,16 +344,18 @@ def main():
                     "type": "table",
                 }
             ))
-        elif hasattr(el, 'text') and el.text.strip():
+        elif (getattr(el, 'text', None) or "").strip():
             # This captures all text elements (Title, NarrativeText, etc.)
-            documents.append(Document(
-                page_content=el.text,
-                metadata={
-                    "source": config.PDF_PATH,
-                    "page_number": el.metadata.page_number,
-                    "type": element_type 
-                }
-            ))
+            # Long blocks are split so each chunk stays within the embedding window
+            for chunk in text_splitter.split_text(el.text):
+                documents.append(Document(
+                    page_content=chunk,
+                    metadata={
+                        "source": config.PDF_PATH,
+                        "page_number": el.metadata.page_number,
+                        "type": type(el).__name__
+                    }
+                ))
             
     if not documents:
         print("No documents were extracted. Exiting.")
@@ -160,15 +364,58 @@ def main():
     print(f"Processed {len(documents)} text, table, and image chunks.")
     print("Creating and populating Qdrant vector store (this will take time)...")
 
-    # 4. Creating and populate the Qdrant vector store
-    # This will store files locally in the config.QDRANT_PATH directory
-    Qdrant.from_documents(
-        documents,
-        embeddings,
+    # 5. Embedding all chunks in batches
+    texts = [doc.page_content for doc in documents]
+    if config.EMBEDDING_BACKEND == "onnx":
+        from onnx_embeddings import OnnxEmbeddings
+        vectors = OnnxEmbeddings().embed_documents(texts)
+    else:
+        vectors = embed_texts(texts)
+    vectors = np.asarray(vectors, dtype=np.float32)
+    # Unit-length vectors make DOT equivalent to cosine without per-query normalization
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    vectors /= norms
+
+    # 6. Creating and populating the Qdrant vector store
+    # Payload layout (page_content + metadata) is what retrieve() in rag_query.py reads
+    client = QdrantClient(
         url=config.QDRANT_URL,
+        grpc_port=config.QDRANT_GRPC_PORT,
+        prefer_grpc=True,
+    )
+    if client.collection_exists(config.COLLECTION_NAME):
+        client.delete_collection(config.COLLECTION_NAME) # Overwrite existing collection
+    client.create_collection(
+        collection_name=config.COLLECTION_NAME,
+        vectors_config=VectorParams(
+            size=vectors.shape[1],
+            distance=Distance.DOT,
+            on_disk=True,
+        ),
+        # int8 vectors kept in RAM for search; originals stay on disk for rescoring
+        quantization_config=ScalarQuantization(
+            scalar=ScalarQuantizationConfig(
+                type=ScalarType.INT8,
+                quantile=0.99,
+                always_ram=True,
+            )
+        ),
+    )
+    client.upload_collection(
         collection_name=config.COLLECTION_NAME,
-        force_recreate=True # Overwrite existing collection
+        vectors=vectors,
+        payload=[
+            {"page_content": doc.page_content, "metadata": doc.metadata}
+            for doc in documents
+        ],
+        ids=list(range(len(documents))),
+        batch_size=config.UPLOAD_BATCH_SIZE,
+        parallel=config.UPLOAD_PARALLEL,
+        wait=True, # Points must be applied before the cache is cleared and queries run
     )
+    # Cached retrieval results refer to the previous index
+    shutil.rmtree(config.RETRIEVAL_CACHE_DIR, ignore_errors=True)
 
     print("---")
     print("Qdrant collection created successfully.")
@@ -0,0 +1,31 @@
+"""
+Parsing for batched LlaVA image descriptions.
+"""
+
+import re
+
+# Header the model is asked to start each description with, e.g. "### IMAGE 2".
+# Markdown decoration (#, *, _) and a trailing ':' or '.' are tolerated.
+HEADER_PATTERN = re.compile(
+    r"^[\s#*_>]*image\s+(\d+)\b[\s*_]*[:.)\-]?[\s*_]*(.*)$",
+    re.IGNORECASE,
+)
+
+def parse_numbered_summaries(text: str, count: int) -> dict:
+    """
+    Parses '### IMAGE N' sections into {N: description}.
+
+    Headers are only accepted in order (1, 2, ... count), so numbered lists
+    or stray image references inside a description are kept as part of it
+    and can never overwrite an earlier image's summary.
+    """
+    summaries = {}
+    current = 0
+    for line in text.splitlines():
+        match = HEADER_PATTERN.match(line)
+        if match and int(match.group(1)) == current + 1 <= count:
+            current += 1
+            summaries[current] = match.group(2).strip()
+        elif current and line.strip():
+            summaries[current] = f"{summaries[current]} {line.strip()}".strip()
+    return summaries
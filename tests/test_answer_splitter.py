@@ -0,0 +1,80 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from answer_splitter import AnswerSplitter, split_summary
+
+
+def stream(chunks):
+    """Feeds chunks through an AnswerSplitter and returns the joined (summary, answer)."""
+    splitter = AnswerSplitter()
+    summary, answer = "", ""
+    for chunk in chunks:
+        s, a = splitter.feed(chunk)
+        summary, answer = summary + s, answer + a
+    s, a = splitter.finish()
+    return summary + s, answer + a, splitter.in_answer
+
+
+def test_split_plain_marker():
+    assert split_summary("The context covers tan 60.\nANSWER: 20/3 m") == (
+        "The context covers tan 60.",
+        "20/3 m",
+    )
+
+
+def test_split_bold_marker():
+    assert split_summary("Summary line.\n**Answer:** 42") == ("Summary line.", "42")
+
+
+def test_split_marker_on_its_own_line():
+    assert split_summary("Summary.\n\n### Answer:\n\nThe height is 5 m.") == (
+        "Summary.",
+        "The height is 5 m.",
+    )
+
+
+def test_split_without_marker_is_all_answer():
+    assert split_summary("No marker here.\nJust text.") == ("", "No marker here.\nJust text.")
+
+
+def test_answer_mid_line_is_not_a_marker():
+    text = "The final answer: is not a marker.\nANSWER: yes"
+    assert split_summary(text) == ("The final answer: is not a marker.", "yes")
+
+
+def test_decoration_split_across_chunks_does_not_leak():
+    summary, answer, in_answer = stream(["Summary.\n**Answer:", "**", " 42"])
+    assert in_answer
+    assert summary == "Summary."
+    assert answer == "42"
+
+
+def test_marker_split_across_chunks():
+    summary, answer, _ = stream(["Sum", "mary.\n**AN", "SWER:** The ", "height is 5 m."])
+    assert summary == "Summary."
+    assert answer == "The height is 5 m."
+
+
+def test_summary_never_ends_with_a_newline_before_the_divider():
+    splitter = AnswerSplitter()
+    released = splitter.feed("Line one.\nLine two.\n")
+    released_at_marker = splitter.feed("Answer: done")
+    summary = released[0] + released_at_marker[0]
+    assert summary == "Line one.\nLine two."
+
+
+def test_no_marker_stream_releases_everything_as_summary():
+    summary, answer, in_answer = stream(["Only a ", "summary.\nSecond line.\n"])
+    assert not in_answer
+    assert summary == "Only a summary.\nSecond line."
+    assert answer == ""
+
+
+def test_stream_matches_split_summary_for_every_chunk_boundary():
+    text = "Key facts: tan 60 = sqrt(3).\n\n**Answer:**\n\n* The tower is 20/3 m tall."
+    expected = split_summary(text)
+    for cut in range(len(text) + 1):
+        summary, answer, _ = stream([text[:cut], text[cut:]])
+        assert (summary.strip(), answer.strip()) == expected
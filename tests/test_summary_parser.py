@@ -0,0 +1,46 @@
+import sys
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1]))
+
+from summary_parser import parse_numbered_summaries
+
+
+def test_parses_headers_and_joins_continuation_lines():
+    text = "### IMAGE 1\nA right triangle ABC\nwith angle 60.\n### IMAGE 2\nA ladder against a wall."
+    assert parse_numbered_summaries(text, 2) == {
+        1: "A right triangle ABC with angle 60.",
+        2: "A ladder against a wall.",
+    }
+
+
+def test_tolerates_markdown_and_inline_descriptions():
+    text = "**Image 1:** A tower\nImage 2. A pole"
+    assert parse_numbered_summaries(text, 2) == {1: "A tower", 2: "A pole"}
+
+
+def test_numbered_lists_stay_in_the_description():
+    text = (
+        "### IMAGE 1\nA right triangle\n1. Side AB = 5 cm\n2. Side BC = 12 cm\n"
+        "### IMAGE 2\nA bar graph"
+    )
+    assert parse_numbered_summaries(text, 2) == {
+        1: "A right triangle 1. Side AB = 5 cm 2. Side BC = 12 cm",
+        2: "A bar graph",
+    }
+
+
+def test_out_of_order_headers_do_not_start_new_images():
+    text = "Image 1: A triangle\nImage 3: the angle at C\nImage 1: repeated"
+    assert parse_numbered_summaries(text, 3) == {
+        1: "A triangle Image 3: the angle at C Image 1: repeated",
+    }
+
+
+def test_headers_beyond_count_are_ignored():
+    text = "### IMAGE 1\nA circle\n### IMAGE 2\nNot sent"
+    assert parse_numbered_summaries(text, 1) == {1: "A circle ### IMAGE 2 Not sent"}
+
+
+def test_text_before_first_header_is_ignored():
+    assert parse_numbered_summaries("Here are the descriptions:\n### IMAGE 1\nA cone", 1) == {1: "A cone"}